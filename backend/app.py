@@ -2,7 +2,7 @@
 Updated Flask app to use the enhanced formula engine with dependency graph.
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
 import logging
 import sys
@@ -21,6 +21,13 @@ except ImportError as e:
     from formula_engine import FormulaEngine
     USE_ENHANCED_ENGINE = False
 
+# Serialize large responses with orjson when it is installed, fallback to Flask's jsonify
+try:
+    import orjson
+    USE_ORJSON = True
+except ImportError:
+    USE_ORJSON = False
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -37,6 +44,16 @@ if USE_ENHANCED_ENGINE:
 else:
     formula_engine = FormulaEngine()
 
+def json_response(payload):
+    """Serialize a response payload in a single fast call when orjson is available."""
+    if USE_ORJSON:
+        try:
+            return Response(orjson.dumps(payload), mimetype='application/json')
+        except orjson.JSONEncodeError:
+            # e.g. integers beyond 64 bits, which the standard encoder still handles
+            pass
+    return jsonify(payload)
+
 @app.before_request
 def before_request():
     headers = {'Access-Control-Allow-Origin': '*',
@@ -79,8 +96,13 @@ def evaluate_formulas():
         
         logger.info(f"Evaluating formulas for grid with {len(grid_data)} rows and {len(columns)} columns")
         
-        # Use the available formula engine
-        result = formula_engine.evaluate_formulas(grid_data, columns)
+        # Use the available formula engine. Clients that resend the same sheet after edits can ask for
+        # incremental evaluation; the previous sheet is kept per gunicorn worker, so a request that
+        # lands on another worker, or follows another client's sheet, falls back to a full evaluation.
+        if USE_ENHANCED_ENGINE and data.get('incremental'):
+            result = formula_engine.evaluate_formulas_incremental(grid_data, columns)
+        else:
+            result = formula_engine.evaluate_formulas(grid_data, columns)
         
         # Add additional info for enhanced engine
         if USE_ENHANCED_ENGINE and result.get('success'):
@@ -90,7 +112,7 @@ def evaluate_formulas():
                 logger.warning(f"Could not get dependency info: {e}")
         
         logger.info(f"Formula evaluation completed: {result.get('message', 'Unknown status')}")
-        return jsonify(result)
+        return json_response(result)
         
     except Exception as e:
         logger.error(f"Error in evaluate_formulas: {str(e)}")
@@ -163,4 +185,5 @@ def validate_formula():
 
 if __name__ == '__main__':
     logger.info("Starting Formula Engine API server...")
-    app.run(host='0.0.0.0', port=8000, debug=True)
\ No newline at end of file
+    # Development server only, production runs under gunicorn (see gunicorn.conf.py)
+    app.run(host='0.0.0.0', port=8000, debug=os.environ.get('FLASK_DEBUG') == '1')
\ No newline at end of file
@@ -3,102 +3,217 @@ In-memory graph database for managing formula dependencies and topological sorti
 """
 
 import logging
-from typing import Dict, List, Set, Any, Tuple, Optional
-from collections import defaultdict, deque
+import weakref
+from typing import Dict, List, Set, Any, Tuple, Optional, Callable
 from dataclasses import dataclass
 
 logger = logging.getLogger(__name__)
 
 
-@dataclass
 class CellRef:
     """Represents a cell reference (e.g., A1, B5)"""
-    column: str
-    row: int
+    __slots__ = ('column', 'row', '_hash', '_str', '__weakref__')
+    
+    # Shared instances, held weakly so cells drop out once no graph or cache uses them
+    _interned: 'weakref.WeakValueDictionary[Tuple[str, int], CellRef]' = weakref.WeakValueDictionary()
+    
+    def __init__(self, column: str, row: int):
+        self.column = column
+        self.row = row
+        self._hash = hash((column, row))
+        self._str = column + str(row)
+    
+    @classmethod
+    def make(cls, column: str, row: int) -> 'CellRef':
+        """Get the shared instance for a cell reference so equal keys are also identical."""
+        key = (column, row)
+        cell = cls._interned.get(key)
+        if cell is None:
+            cell = cls._interned[key] = cls(column, row)
+        return cell
     
     def __str__(self):
-        return f"{self.column}{self.row}"
+        return self._str
+    
+    def __repr__(self):
+        return self._str
+    
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if not isinstance(other, CellRef):
+            return NotImplemented
+        return self.column == other.column and self.row == other.row
     
     def __hash__(self):
-        return hash((self.column, self.row))
+        return self._hash
 
 
-@dataclass
+@dataclass(slots=True)
 class FormulaNode:
     """Represents a formula node in the dependency graph"""
     cell_ref: CellRef
     formula: str
-    dependencies: Set[CellRef]
-    dependents: Set[CellRef]
+    compiled: Any = None
     value: Any = None
     is_evaluated: bool = False
     has_error: bool = False
     error_message: str = None
 
 
+def _kahn_csr(indptr: List[int], indices: List[int], in_degree: List[int]) -> List[List[int]]:
+    """
+    Kahn's algorithm over an integer graph in CSR form. Consumes the given in-degree list.
+    Returns node ids grouped into layers; ids in the same layer do not depend on each other.
+    """
+    layers = []
+    layer = [i for i, degree in enumerate(in_degree) if degree == 0]
+    while layer:
+        layers.append(layer)
+        next_layer = []
+        append = next_layer.append
+        for current in layer:
+            for target in indices[indptr[current]:indptr[current + 1]]:
+                in_degree[target] -= 1
+                if in_degree[target] == 0:
+                    append(target)
+        layer = next_layer
+    
+    return layers
+
+
 class DependencyGraph:
     """
     In-memory graph database for managing formula dependencies.
     Handles circular dependency detection and provides topological sorting.
     """
     
-    def __init__(self):
+    def __init__(self, compiler: Optional[Callable[[str], Any]] = None):
+        # Optional hook that turns a formula string into an evaluator-ready form once per insert
+        self._compiler = compiler
         self.nodes: Dict[CellRef, FormulaNode] = {}
-        self.adjacency_list: Dict[CellRef, Set[CellRef]] = defaultdict(set)
-        self.reverse_adjacency_list: Dict[CellRef, Set[CellRef]] = defaultdict(set)
+        # Plain dicts: a cell only gets an edge set once it has an edge, reads use .get()
+        self.adjacency_list: Dict[CellRef, Set[CellRef]] = {}
+        self.reverse_adjacency_list: Dict[CellRef, Set[CellRef]] = {}
         self._evaluation_order: List[CellRef] = []
+        self._evaluation_layers: List[List[CellRef]] = []
+        # Topological position of every formula node, kept valid across inserts (Pearce-Kelly).
+        # Positions are distinct but not contiguous; the flat order is just the nodes sorted by them.
+        self._ord: Dict[CellRef, int] = {}
+        self._next_ord: int = 0
+        self._order_stale: bool = False  # _evaluation_order needs re-reading from _ord
+        self._layers_dirty: bool = False  # _evaluation_layers needs a Kahn pass
+        self._order_dirty: bool = False  # _ord itself is unusable and needs a full Kahn rebuild
+        # Number of formula nodes each formula node depends on, kept up to date on insert and removal
+        self._in_degree: Dict[CellRef, int] = {}
+        # Integer-remapped copy of the formula subgraph: (cells, indptr, indices, in_degree)
+        self._csr: Tuple[List[CellRef], List[int], List[int], List[int]] = ([], [0], [], [])
+        self._csr_dirty: bool = False
         self._dirty_cells: Set[CellRef] = set()
+        # Set by the topological sort, which can only fail to place every node if there is a cycle
+        self._has_cycles: bool = False
+        # Running maxima for get_graph_stats, rescanned only after a removal may have lowered them
+        self._max_dependencies: int = 0
+        self._max_dependents: int = 0
+        self._stats_dirty: bool = False
     
-    def add_formula(self, cell_ref: CellRef, formula: str, dependencies: Set[CellRef]) -> bool:
+    def add_formula(self, cell_ref: CellRef, formula: str, dependencies: Set[CellRef],
+                    visited: Optional[Set[CellRef]] = None) -> bool:
         """Add or update a formula in the graph."""
         try:
             # Remove existing node if it exists
             if cell_ref in self.nodes:
                 self._remove_node(cell_ref)
             
-            # Create new node
-            node = FormulaNode(
-                cell_ref=cell_ref,
-                formula=formula,
-                dependencies=dependencies.copy(),
-                dependents=set()
-            )
-            
             # Check for circular dependencies before adding
-            logger.info(f"Testing for circular dependencies for {cell_ref} with dependencies {dependencies},{len(dependencies)}")
-            if self._would_create_cycle(cell_ref, dependencies):
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Testing for circular dependencies for {cell_ref} with dependencies {dependencies},{len(dependencies)}")
+            if self._would_create_cycle(cell_ref, dependencies, visited):
                 logger.warning(f"Circular dependency detected for cell {cell_ref}")
                 return False
             
             # Add node to graph
+            node = FormulaNode(cell_ref=cell_ref, formula=formula)
+            if self._compiler is not None:
+                node.compiled = self._compiler(formula)
             self.nodes[cell_ref] = node
             
-            # Update adjacency lists
+            # Update adjacency lists, these are the only record of the edges
             for dep in dependencies:
-                self.adjacency_list[dep].add(cell_ref)
-                self.reverse_adjacency_list[cell_ref].add(dep)
-                
-                # Update dependent's dependents list
-                if dep in self.nodes:
-                    self.nodes[dep].dependents.add(cell_ref)
+                dependents = self.adjacency_list.setdefault(dep, set())
+                dependents.add(cell_ref)
+                self.reverse_adjacency_list.setdefault(cell_ref, set()).add(dep)
+                if dep in self.nodes and len(dependents) > self._max_dependents:
+                    self._max_dependents = len(dependents)
+            
+            # The new node waits on its formula dependencies, and formulas that
+            # already read this cell now wait on it too
+            self._in_degree[cell_ref] = sum(1 for dep in dependencies if dep in self.nodes)
+            for dependent in self.adjacency_list.get(cell_ref, ()):
+                if dependent in self._in_degree:
+                    self._in_degree[dependent] += 1
+            
+            self._max_dependencies = max(self._max_dependencies, len(dependencies))
+            self._max_dependents = max(self._max_dependents, len(self.adjacency_list.get(cell_ref, ())))
             
             # Mark this cell and its dependents as dirty
             self._mark_dirty(cell_ref)
             
-            # Recalculate evaluation order
-            self._update_evaluation_order()
+            # Keep the topological order current. The new node goes last, which already
+            # satisfies its own dependencies; only formulas that read it sit too early.
+            if not self._order_dirty:
+                self._ord[cell_ref] = self._next_ord
+                self._next_ord += 1
+                for dependent in self.adjacency_list.get(cell_ref, ()):
+                    if dependent in self._ord:
+                        self._reorder_for_edge(cell_ref, dependent)
+                self._order_stale = True
+            self._layers_dirty = True
+            self._csr_dirty = True
             
-            logger.info(f"Added formula {formula} for cell {cell_ref}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Added formula {formula} for cell {cell_ref}")
             return True
             
         except Exception as e:
             logger.error(f"Error adding formula for cell {cell_ref}: {str(e)}")
             return False
     
+    def batch_add_formulas(self, items: List[Tuple[CellRef, str, Set[CellRef]]]) -> List[bool]:
+        """Add many formulas at once and materialize the evaluation order a single time afterwards."""
+        # Positions are not maintained per insert here, one Kahn pass at the end rebuilds them
+        self._order_dirty = True
+        visited = set()
+        results = [self.add_formula(cell_ref, formula, dependencies, visited)
+                   for cell_ref, formula, dependencies in items]
+        self._ensure_evaluation_order()
+        return results
+    
     def get_evaluation_order(self) -> List[CellRef]:
         """Get the topologically sorted evaluation order for all formulas."""
+        self._ensure_evaluation_order()
         return self._evaluation_order.copy()
-    
+
+    def get_layers(self) -> List[List[CellRef]]:
+        """Get the evaluation order grouped into layers of mutually independent formulas."""
+        if self._order_dirty or self._layers_dirty:
+            self._update_evaluation_order()
+            self._order_dirty = False
+        return [layer.copy() for layer in self._evaluation_layers]
+
+    def get_dirty_evaluation_order(self) -> List[CellRef]:
+        """Get the evaluation order restricted to dirty cells and everything depending on them."""
+        affected = set(self._dirty_cells)
+        stack = list(self._dirty_cells)
+        while stack:
+            for dependent in self.adjacency_list.get(stack.pop(), ()):
+                if dependent not in affected:
+                    affected.add(dependent)
+                    stack.append(dependent)
+
+        self._ensure_evaluation_order()
+        return [cell for cell in self._evaluation_order if cell in affected]
+
     def mark_cell_evaluated(self, cell_ref: CellRef, value: Any, has_error: bool = False, error_message: str = None):
         """Mark a cell as evaluated with its result."""
         if cell_ref in self.nodes:
@@ -113,44 +228,73 @@ class DependencyGraph:
     
     def has_circular_dependency(self) -> Tuple[bool, Optional[List[CellRef]]]:
         """Check if the graph has circular dependencies."""
+        # The sort already proved the graph acyclic unless it came up short
+        self._ensure_evaluation_order()
+        if not self._has_cycles:
+            return False, None
+        
+        # Shared across all start nodes so every edge is walked at most once
         visited = set()
-        rec_stack = set()
         
-        def dfs(node: CellRef, path: List[CellRef]) -> Optional[List[CellRef]]:
-            visited.add(node)
-            rec_stack.add(node)
-            current_path = path + [node]
+        for start in self.nodes:
+            if start in visited:
+                continue
             
-            for neighbor in self.adjacency_list[node]:
-                if neighbor not in visited:
-                    cycle = dfs(neighbor, current_path)
-                    if cycle:
-                        return cycle
-                elif neighbor in rec_stack:
-                    # Found a cycle
-                    cycle_start = current_path.index(neighbor)
-                    return current_path[cycle_start:] + [neighbor]
+            # Explicit DFS stack of neighbor iterators, with the current path and each node's position in it
+            visited.add(start)
+            path = [start]
+            pos_in_path = {start: 0}
+            stack = [iter(self.adjacency_list.get(start, ()))]
             
-            rec_stack.remove(node)
-            return None
-        
-        for node in self.nodes:
-            if node not in visited:
-                cycle = dfs(node, [])
-                if cycle:
-                    return True, cycle
+            while stack:
+                neighbor = next(stack[-1], None)
+                if neighbor is None:
+                    stack.pop()
+                    del pos_in_path[path.pop()]
+                    continue
+                
+                if neighbor in pos_in_path:
+                    # Found a cycle
+                    return True, self._normalize_cycle(path[pos_in_path[neighbor]:])
+                
+                if neighbor not in visited:
+                    visited.add(neighbor)
+                    pos_in_path[neighbor] = len(path)
+                    path.append(neighbor)
+                    stack.append(iter(self.adjacency_list.get(neighbor, ())))
         
         return False, None
     
+    @staticmethod
+    def _normalize_cycle(cycle: List[CellRef]) -> List[CellRef]:
+        """Rotate a cycle to start at its smallest cell and close it, so each cycle is reported one way."""
+        start = min(range(len(cycle)), key=lambda i: (cycle[i].column, cycle[i].row))
+        rotated = cycle[start:] + cycle[:start]
+        return rotated + [rotated[0]]
+    
+    def get_dependencies(self, cell_ref: CellRef) -> Set[CellRef]:
+        """Get the cells a formula reads from."""
+        return set(self.reverse_adjacency_list.get(cell_ref, ()))
+    
+    def get_dependents(self, cell_ref: CellRef) -> Set[CellRef]:
+        """Get the formulas that read from a cell."""
+        return set(self.adjacency_list.get(cell_ref, ()))
+    
     def get_graph_stats(self) -> Dict[str, Any]:
         """Get statistics about the dependency graph."""
+        self._ensure_evaluation_order()
+        if self._stats_dirty:
+            self._max_dependencies = max((len(self.reverse_adjacency_list.get(cell, ())) for cell in self.nodes), default=0)
+            self._max_dependents = max((len(self.adjacency_list.get(cell, ())) for cell in self.nodes), default=0)
+            self._stats_dirty = False
+        
         return {
             'total_formulas': len(self.nodes),
             'dirty_cells': len(self._dirty_cells),
             'evaluation_order_length': len(self._evaluation_order),
-            'has_cycles': self.has_circular_dependency()[0],
-            'max_dependencies': max(len(node.dependencies) for node in self.nodes.values()) if self.nodes else 0,
-            'max_dependents': max(len(node.dependents) for node in self.nodes.values()) if self.nodes else 0
+            'has_cycles': self._has_cycles,
+            'max_dependencies': self._max_dependencies,
+            'max_dependents': self._max_dependents
         }
     
     def _remove_node(self, cell_ref: CellRef):
@@ -158,133 +302,225 @@ class DependencyGraph:
         if cell_ref not in self.nodes:
             return
         
-        node = self.nodes[cell_ref]
-        
-        # Remove edges from dependencies
-        for dep in node.dependencies:
-            self.adjacency_list[dep].discard(cell_ref)
-            if dep in self.nodes:
-                self.nodes[dep].dependents.discard(cell_ref)
-        
-        # Remove edges to dependents
-        for dependent in node.dependents:
-            self.reverse_adjacency_list[dependent].discard(cell_ref)
-            if dependent in self.nodes:
-                self.nodes[dependent].dependencies.discard(cell_ref)
+        # Drop the formula's own dependency edges. Edges to its dependents stay:
+        # those formulas still read this cell, which is now a plain value cell.
+        for dep in self.reverse_adjacency_list.pop(cell_ref, ()):
+            self._discard_edge(self.adjacency_list, dep, cell_ref)
         
-        # Remove from adjacency lists
-        if cell_ref in self.adjacency_list:
-            del self.adjacency_list[cell_ref]
-        if cell_ref in self.reverse_adjacency_list:
-            del self.reverse_adjacency_list[cell_ref]
+        # Dependents no longer wait on this cell once it stops being a formula
+        del self._in_degree[cell_ref]
+        for dependent in self.adjacency_list.get(cell_ref, ()):
+            if dependent in self._in_degree:
+                self._in_degree[dependent] -= 1
         
-        # Remove node
+        # Remove node, dropping it from a topological order leaves the rest of it valid
         del self.nodes[cell_ref]
+        self._ord.pop(cell_ref, None)
+        self._order_stale = True
+        self._layers_dirty = True
+        self._csr_dirty = True
+        self._stats_dirty = True
     
-    def _would_create_cycle(self, new_cell: CellRef, dependencies: Set[CellRef]) -> bool:
-        """Check if adding this formula would create a circular dependency."""
-        # Temporarily add the edges to check for cycles
-        temp_adjacency = defaultdict(set)
-        for cell, deps in self.adjacency_list.items():
-            temp_adjacency[cell] = deps.copy()
+    @staticmethod
+    def _discard_edge(edges: Dict[CellRef, Set[CellRef]], source: CellRef, target: CellRef):
+        """Remove one edge from an adjacency dict, dropping the source's set once it is empty."""
+        targets = edges.get(source)
+        if targets is not None:
+            targets.discard(target)
+            if not targets:
+                del edges[source]
+    
+    def _would_create_cycle(self, new_cell: CellRef, dependencies: Set[CellRef],
+                            visited: Optional[Set[CellRef]] = None) -> bool:
+        """Check if adding this formula would create a circular dependency, searching from both ends."""
+        if new_cell in dependencies:
+            return True
         
-        # Add new dependencies
-        for dep in dependencies:
-            temp_adjacency[dep].add(new_cell)
+        if visited is None:
+            visited = set()
+        else:
+            visited.clear()
         
-        # Check for cycles using DFS
-        visited = set()
-        rec_stack = set()
+        adjacency_list = self.adjacency_list
+        reverse_adjacency_list = self.reverse_adjacency_list
+        # Only formula cells have anything upstream, plain value dependencies end the backward side
+        backward = [dep for dep in dependencies if dep in reverse_adjacency_list]
+        if not backward or new_cell not in adjacency_list:
+            return False
         
-        def has_cycle_dfs(node: CellRef) -> bool:
-            visited.add(node)
-            rec_stack.add(node)
-            
-            for neighbor in temp_adjacency[node]:
-                if neighbor not in visited:
-                    if has_cycle_dfs(neighbor):
-                        return True
-                elif neighbor in rec_stack:
+        forward = [new_cell]
+        backward_seen = set()
+        while forward and backward:
+            for dependent in adjacency_list.get(forward.pop(), ()):
+                if dependent in dependencies or dependent in backward_seen:
                     return True
+                if dependent not in visited:
+                    visited.add(dependent)
+                    forward.append(dependent)
             
-            rec_stack.remove(node)
-            return False
-        
-        # Check all nodes (including the new one)
-        all_nodes = set(self.nodes.keys()) | {new_cell}
-        for node in all_nodes:
-            if node not in visited:
-                if has_cycle_dfs(node):
+            for upstream in reverse_adjacency_list.get(backward.pop(), ()):
+                if upstream == new_cell or upstream in visited:
                     return True
+                if upstream not in backward_seen and upstream not in dependencies:
+                    backward_seen.add(upstream)
+                    backward.append(upstream)
         
         return False
     
     def _mark_dirty(self, cell_ref: CellRef):
         """Mark a cell and all its dependents as dirty (needing re-evaluation)."""
-        dirty_queue = deque([cell_ref])
+        # Expand one layer of dependents at a time with C-level set operations
+        dirty_cells = self._dirty_cells
+        frontier = {cell_ref}
         
-        while dirty_queue:
-            current = dirty_queue.popleft()
-            if current in self._dirty_cells:
-                continue
+        while frontier:
+            frontier -= dirty_cells
+            if not frontier:
+                break
             
-            self._dirty_cells.add(current)
+            dirty_cells |= frontier
             
-            # Add all dependents to the queue
-            if current in self.nodes:
-                dirty_queue.extend(self.nodes[current].dependents)
+            next_frontier = set()
+            for current in frontier:
+                node = self.nodes.get(current)
+                if node is not None:
+                    node.is_evaluated = False
+                next_frontier.update(self.adjacency_list.get(current, ()))
+            frontier = next_frontier
 
     def get_dirty_cells(self) -> Set[CellRef]:
         """Get all cells that are marked as dirty."""
         return self._dirty_cells.copy()
 
+    def mark_dirty(self, cell_ref: CellRef):
+        """Mark a changed cell and everything depending on it as needing re-evaluation."""
+        self._mark_dirty(cell_ref)
+
+    def clear_dirty_cells(self):
+        """Forget all dirty cells, e.g. once the changed inputs have been recalculated."""
+        self._dirty_cells.clear()
+
+    def remove_formula(self, cell_ref: CellRef):
+        """Remove a formula node (the cell now holds a plain value) and mark its dependents dirty."""
+        if cell_ref in self.nodes:
+            self._remove_node(cell_ref)
+            self._mark_dirty(cell_ref)
+
+    def _ensure_evaluation_order(self):
+        """Bring the flat evaluation order up to date with the graph."""
+        if self._order_dirty:
+            self._update_evaluation_order()
+            self._order_dirty = False
+        elif self._order_stale:
+            self._evaluation_order = sorted(self._ord, key=self._ord.__getitem__)
+            self._order_stale = False
+
+    def _reorder_for_edge(self, source: CellRef, target: CellRef):
+        """
+        Restore the topological order after adding the edge source -> target (Pearce-Kelly).
+        Only the nodes positioned between target and source can be affected; they are
+        shuffled within their own positions so that everything source needs comes first.
+        """
+        ord_ = self._ord
+        lower, upper = ord_[target], ord_[source]
+        if lower > upper:
+            return
+        
+        # Formulas reachable from target that currently sit before source
+        forward, seen, stack = [], {target}, [target]
+        while stack:
+            cell = stack.pop()
+            forward.append(cell)
+            for nxt in self.adjacency_list.get(cell, ()):
+                if nxt not in seen and nxt in ord_ and ord_[nxt] < upper:
+                    seen.add(nxt)
+                    stack.append(nxt)
+        
+        # Formulas source depends on that currently sit after target
+        backward, seen, stack = [], {source}, [source]
+        while stack:
+            cell = stack.pop()
+            backward.append(cell)
+            for prev in self.reverse_adjacency_list.get(cell, ()):
+                if prev not in seen and prev in ord_ and ord_[prev] > lower:
+                    seen.add(prev)
+                    stack.append(prev)
+        
+        # Reuse the freed positions: the backward set first, then the forward set, each in relative order
+        backward.sort(key=ord_.__getitem__)
+        forward.sort(key=ord_.__getitem__)
+        moved = backward + forward
+        for cell, position in zip(moved, sorted(ord_[cell] for cell in moved)):
+            ord_[cell] = position
+
+    def _get_csr(self) -> Tuple[List[CellRef], List[int], List[int], List[int]]:
+        """Get the formula subgraph remapped to integer ids, rebuilding it if the graph changed."""
+        if self._csr_dirty:
+            # _in_degree has exactly the formula nodes as keys, so ids and degrees come out aligned
+            cells = list(self._in_degree)
+            in_degree = list(self._in_degree.values())
+            index = {cell: i for i, cell in enumerate(cells)}
+            indptr = [0]
+            indices = []
+            for cell in cells:
+                # Keep only edges to other formula nodes
+                for dependent in self.adjacency_list.get(cell, ()):
+                    target = index.get(dependent)
+                    if target is not None:
+                        indices.append(target)
+                indptr.append(len(indices))
+            self._csr = (cells, indptr, indices, in_degree)
+            self._csr_dirty = False
+        return self._csr
+
     def _update_evaluation_order(self):
         """Update the topological evaluation order using Kahn's algorithm."""
         try:
             # Only sort formula nodes (nodes that have formulas)
             formula_nodes = list(self.nodes.keys())
             
+            # Whatever happens below leaves the order, positions and layers in sync
+            self._order_stale = False
+            self._layers_dirty = False
+            
             if not formula_nodes:
                 self._evaluation_order = []
-                logger.info("No formula nodes to sort")
+                self._evaluation_layers = []
+                self._ord = {}
+                self._has_cycles = False
+                logger.debug("No formula nodes to sort")
                 return
             
-            # Calculate in-degrees only for formula nodes
-            # A formula node's in-degree is the number of OTHER formula nodes it depends on
-            in_degree = defaultdict(int)
-            
-            for node in formula_nodes:
-                in_degree[node] = 0
-                # Count dependencies that are also formula nodes
-                for dep in self.nodes[node].dependencies:
-                    if dep in self.nodes:  # Only count if dependency is also a formula node
-                        in_degree[node] += 1
-            
-            # Initialize queue with formula nodes that have no formula dependencies
-            queue = deque([node for node in formula_nodes if in_degree[node] == 0])
-            result = []
-            
-            while queue:
-                current = queue.popleft()
-                result.append(current)
-                
-                # Decrease in-degree of dependent formula nodes
-                for dependent in self.adjacency_list[current]:
-                    if dependent in self.nodes:  # Only process if it's a formula node
-                        in_degree[dependent] -= 1
-                        if in_degree[dependent] == 0:
-                            queue.append(dependent)
+            # Sort integer ids instead of CellRefs so the inner loop does no hashing
+            cells, indptr, indices, in_degree = self._get_csr()
+            # Sort on a copy so the cached degrees survive
+            layers = [[cells[i] for i in layer] for layer in _kahn_csr(indptr, indices, in_degree.copy())]
+            self._evaluation_layers = layers
+            result = [cell for layer in layers for cell in layer]
             
             # Check if all formula nodes were processed (no cycles among formulas)
-            if len(result) != len(formula_nodes):
+            self._has_cycles = len(result) != len(formula_nodes)
+            if self._has_cycles:
                 logger.error(f"Topological sort failed - circular dependency detected among formulas. Processed {len(result)}/{len(formula_nodes)} nodes")
                 # Still use partial result for debugging
                 self._evaluation_order = result
             else:
                 self._evaluation_order = result
             
-            logger.info(f"Updated evaluation order: {[str(cell) for cell in self._evaluation_order]}")
+            # Restart the incremental positions from the sorted order; nodes stuck in a cycle go last
+            self._ord = {cell: i for i, cell in enumerate(result)}
+            for cell in formula_nodes:
+                self._ord.setdefault(cell, len(self._ord))
+            self._next_ord = len(self._ord)
+            
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Updated evaluation order: {[str(cell) for cell in self._evaluation_order]}")
             
         except Exception as e:
             logger.error(f"Error updating evaluation order: {str(e)}")
-            self._evaluation_order = list(self.nodes.keys())
\ No newline at end of file
+            self._evaluation_order = list(self.nodes.keys())
+            # Unknown, let has_circular_dependency do a full scan
+            self._has_cycles = True
+            self._evaluation_layers = [self._evaluation_order.copy()]
+            self._ord = {cell: i for i, cell in enumerate(self._evaluation_order)}
+            self._next_ord = len(self._ord)
\ No newline at end of file
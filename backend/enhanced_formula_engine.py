@@ -4,12 +4,170 @@ Enhanced formula evaluation engine with dependency graph and topological sorting
 
 import re
 import logging
-from typing import Dict, List, Any, Union, Tuple, Set
-from dependency_graph import DependencyGraph, CellRef, FormulaNode
+from functools import lru_cache
+from typing import Dict, List, Any, Union, Tuple, Set, Optional, Callable
+from dependency_graph import DependencyGraph, CellRef
 from formula_parser import FormulaParser
 
 logger = logging.getLogger(__name__)
 
+# One formula token, matched at the current position with leading whitespace skipped;
+# the alternative that matched is told apart by match.lastgroup
+_TOKEN_RE = re.compile(
+    r'\s*(?:(?P<func>[A-Z]+)\('
+    r'|(?P<cell>(?P<col>[A-Z]+)(?P<row>\d+))'
+    r'|(?P<num>(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][+-]?\d+)?)'
+    r'|(?P<op>[-+*/()]))'
+)
+_CELL_RE = re.compile(r'([A-Z]+)(\d+)')
+_RANGE_RE = re.compile(r'([A-Z]+)(\d+):([A-Z]+)(\d+)')
+_NUM_CLEAN_RE = re.compile(r'[^\d\.\-]')
+
+
+@lru_cache(maxsize=4096)
+def _compile(formula: str) -> tuple:
+    """
+    Parse a formula once into a tuple AST. Nodes are ('num', value), ('cell', column, row_index),
+    ('neg', operand), ('bin', operator, left, right), ('func', name, args_str) and
+    ('error', code) for formulas that cannot be parsed.
+    """
+    expression = formula[1:].upper().strip()
+    try:
+        node, pos = _parse_expression(expression, 0)
+        if pos != len(expression):
+            raise ValueError(f"Unexpected input at position {pos}")
+        return node
+    except (ValueError, RecursionError) as e:
+        logger.debug(f"Could not parse formula '{formula}': {str(e)}")
+        return ('error', '#ERROR!')
+
+
+def _match_operator(text: str, pos: int, operators: str):
+    """Match one of the given operators at pos, or return None."""
+    match = _TOKEN_RE.match(text, pos)
+    if match and match.lastgroup == 'op' and match.group('op') in operators:
+        return match
+    return None
+
+
+def _parse_expression(text: str, pos: int) -> Tuple[tuple, int]:
+    """expression := term (('+' | '-') term)*"""
+    node, pos = _parse_term(text, pos)
+    while True:
+        match = _match_operator(text, pos, '+-')
+        if not match:
+            return node, pos
+        right, pos = _parse_term(text, match.end())
+        node = ('bin', match.group('op'), node, right)
+
+
+def _parse_term(text: str, pos: int) -> Tuple[tuple, int]:
+    """term := factor (('*' | '/') factor)*"""
+    node, pos = _parse_factor(text, pos)
+    while True:
+        match = _match_operator(text, pos, '*/')
+        if not match:
+            return node, pos
+        right, pos = _parse_factor(text, match.end())
+        node = ('bin', match.group('op'), node, right)
+
+
+def _parse_factor(text: str, pos: int) -> Tuple[tuple, int]:
+    """factor := ('-' | '+') factor | '(' expression ')' | function | cell | number"""
+    match = _TOKEN_RE.match(text, pos)
+    if not match:
+        raise ValueError(f"Unexpected input at position {pos}")
+    
+    kind = match.lastgroup
+    if kind == 'op':
+        operator = match.group('op')
+        if operator == '-':
+            operand, pos = _parse_factor(text, match.end())
+            return ('neg', operand), pos
+        if operator == '+':
+            return _parse_factor(text, match.end())
+        if operator == '(':
+            node, pos = _parse_expression(text, match.end())
+            match = _match_operator(text, pos, ')')
+            if not match:
+                raise ValueError("Unmatched opening parenthesis")
+            return node, match.end()
+        raise ValueError(f"Unexpected '{operator}' at position {pos}")
+    
+    if kind == 'func':
+        # Arguments are kept as text up to the matching closing parenthesis
+        depth, end = 1, match.end()
+        while depth:
+            if end >= len(text):
+                raise ValueError("Unmatched opening parenthesis")
+            char = text[end]
+            if char == '(':
+                depth += 1
+            elif char == ')':
+                depth -= 1
+            end += 1
+        return ('func', match.group('func'), text[match.end():end - 1].strip()), end
+    
+    if kind == 'cell':
+        return ('cell', match.group('col'), int(match.group('row')) - 1), match.end()
+    
+    return ('num', float(match.group('num'))), match.end()
+
+
+@lru_cache(maxsize=4096)
+def _parse_arg_list(args_str: str) -> Optional[tuple]:
+    """
+    Split a comma-separated argument list into (column, row_index) pairs and numbers.
+    Returns None if an item is neither a cell reference nor a number.
+    """
+    items = []
+    for item in args_str.split(','):
+        item = item.strip()
+        match = _CELL_RE.fullmatch(item)
+        if match:
+            items.append((match.group(1), int(match.group(2)) - 1))
+        else:
+            try:
+                items.append(float(item))
+            except ValueError:
+                return None
+    return tuple(items)
+
+
+# Extracted dependencies by formula text. Formulas whose ranges expand to more cells than
+# the limit are not kept, so one large range cannot pin its whole expansion in memory.
+_DEPENDENCY_CACHE_SIZE = 8192
+_DEPENDENCY_CACHE_MAX_CELLS = 256
+_dependency_cache: Dict[str, frozenset] = {}
+
+
+def _extract_dependencies(parser: FormulaParser, formula: str) -> frozenset:
+    """Dependencies of a formula, extracted once per formula text unless they are large."""
+    dependencies = _dependency_cache.get(formula)
+    if dependencies is None:
+        dependencies = parser.extract_dependencies(formula)
+        if len(dependencies) <= _DEPENDENCY_CACHE_MAX_CELLS:
+            if len(_dependency_cache) >= _DEPENDENCY_CACHE_SIZE:
+                # Drop the oldest entry, dicts keep insertion order
+                del _dependency_cache[next(iter(_dependency_cache))]
+            _dependency_cache[formula] = dependencies
+    return dependencies
+
+
+class FormulaError(Exception):
+    """Raised inside a specialized formula to abort it with an Excel-style error code."""
+    
+    def __init__(self, code: str):
+        super().__init__(code)
+        self.code = code
+
+
+def _raiser(code: str) -> Callable[[], Any]:
+    """A specialized formula that fails with the given error code."""
+    def fail():
+        raise FormulaError(code)
+    return fail
+
 
 class EnhancedFormulaEngine:
     """Enhanced formula evaluation engine with dependency graph management."""
@@ -27,9 +185,23 @@ class EnhancedFormulaEngine:
         }
         self._data_context = []
         self._columns_context = []
+        # Column-major numeric snapshot of the sheet: _matrix[col_idx][row_index]
+        self._matrix: List[List[float]] = []
+        self._filled: List[List[bool]] = []  # non-empty cells, for COUNT
+        self._col_idx: Dict[str, int] = {}
+        self._col_by_letter: Dict[str, Dict] = {}
+        self._row_count = 0
+        # Inputs and results of the last successful evaluation, for evaluate_formulas_incremental
+        self._last_input = None
+        self._last_output = None
+        self._last_column_keys = None
+        self._cell_errors = {}
     
     def _format_number(self, value: Union[float, int, str]) -> str:
         """Format numerical values to display as integers when possible, floats otherwise."""
+        # Formula results are nearly always floats
+        if type(value) is float:
+            return str(int(value)) if value.is_integer() else str(value)
         if isinstance(value, (int, float)):
             # Check if it's a whole number
             if isinstance(value, float) and value.is_integer():
@@ -41,12 +213,18 @@ class EnhancedFormulaEngine:
                 return str(value)
         return str(value)
     
-    def evaluate_formulas(self, data: List[Dict], columns: List[Dict]) -> Dict[str, Any]:
-        """Evaluate all formulas in the dataset using dependency graph."""
+    def evaluate_formulas(self, data: List[Dict], columns: List[Dict],
+                          remember: bool = False) -> Dict[str, Any]:
+        """
+        Evaluate all formulas in the dataset using dependency graph.
+        The sheet is only kept for evaluate_formulas_incremental when remember is set.
+        """
         try:
             # Store context for evaluation
-            self._data_context = data.copy()
+            self._data_context = data
             self._columns_context = columns.copy()
+            self._index_columns(columns)
+            self._materialize(data, columns)
             
             # Step 1: Build dependency graph
             self._build_dependency_graph(data, columns)
@@ -67,6 +245,7 @@ class EnhancedFormulaEngine:
                             cell_key = f"{row_index}-{column_key}"
                             cycle_errors[cell_key] = f"Circular dependency: {cycle_str}"
                 
+                self._last_input = None
                 return {
                     'success': False,
                     'error': f"Circular dependency detected: {cycle_str}",
@@ -79,65 +258,14 @@ class EnhancedFormulaEngine:
             evaluation_order = self.dependency_graph.get_evaluation_order()
             logger.info(f"Evaluating {len(evaluation_order)} formulas in dependency order")
             
-            # Step 4: Evaluate formulas in order
-            new_data = [row.copy() for row in data]
-            evaluation_stats = {'evaluated': 0, 'errors': 0, 'cached': 0}
-            cell_errors = {}  # Track individual cell errors
-            
-            for cell_ref in evaluation_order:
-                try:
-                    node = self.dependency_graph.nodes[cell_ref]
-                    
-                    # Skip if already evaluated
-                    if node.is_evaluated:
-                        evaluation_stats['cached'] += 1
-                        continue
-                    
-                    # Get the row and column
-                    row_index = cell_ref.row - 1  # Convert to 0-based index
-                    column_key = self._letter_to_column_key(cell_ref.column, columns)
-                    
-                    if row_index < 0 or row_index >= len(new_data) or not column_key:
-                        logger.warning(f"Invalid cell reference: {cell_ref}")
-                        cell_key = f"{row_index}-{cell_ref.column}"
-                        cell_errors[cell_key] = "Invalid cell reference"
-                        continue
-                    
-                    # Evaluate the formula
-                    result = self._evaluate_formula(
-                        node.formula, row_index, column_key, new_data, columns
-                    )
-                    
-                    # Create cell key for error tracking
-                    cell_key = f"{row_index}-{column_key}"
-                    
-                    # Update the result in data
-                    if isinstance(result, str) and result.startswith('#'):
-                        # Error result
-                        new_data[row_index][column_key] = result
-                        self.dependency_graph.mark_cell_evaluated(cell_ref, result, has_error=True, error_message=result)
-                        cell_errors[cell_key] = result
-                        evaluation_stats['errors'] += 1
-                    else:
-                        # Success result
-                        new_data[row_index][column_key] = self._format_number(result) if result is not None else '0'
-                        self.dependency_graph.mark_cell_evaluated(cell_ref, result, has_error=False)
-                        evaluation_stats['evaluated'] += 1
-                    
-                    logger.debug(f"Evaluated {cell_ref}: {node.formula} = {result}")
-                    
-                except Exception as e:
-                    logger.error(f"Error evaluating formula for cell {cell_ref}: {str(e)}")
-                    row_index = cell_ref.row - 1
-                    column_key = self._letter_to_column_key(cell_ref.column, columns)
-                    cell_key = f"{row_index}-{column_key}" if column_key else f"{row_index}-{cell_ref.column}"
-                    
-                    if row_index < len(new_data) and column_key:
-                        new_data[row_index][column_key] = '#ERROR!'
-                        self.dependency_graph.mark_cell_evaluated(cell_ref, '#ERROR!', has_error=True, error_message=str(e))
-                    
-                    cell_errors[cell_key] = str(e)
-                    evaluation_stats['errors'] += 1
+            # Step 4: Evaluate formulas in order, only rows receiving results are copied
+            new_data = list(data)
+            self._copy_written_rows(evaluation_order, new_data, set())
+            evaluation_stats, cell_errors = self._evaluate_cells(evaluation_order, new_data, columns)
+            if remember:
+                self._remember_evaluation(data, new_data, columns, cell_errors)
+            else:
+                self._last_input = self._last_output = None
             
             # Get graph statistics
             graph_stats = self.dependency_graph.get_graph_stats()
@@ -159,6 +287,7 @@ class EnhancedFormulaEngine:
             
         except Exception as e:
             logger.error(f"Error in evaluate_formulas: {str(e)}")
+            self._last_input = None
             # Include any circular dependency errors that were detected before the exception
             return {
                 'success': False,
@@ -168,124 +297,380 @@ class EnhancedFormulaEngine:
                 'data': data
             }
     
+    def evaluate_formulas_incremental(self, data: List[Dict], columns: List[Dict],
+                                      changed_cells: Optional[Set[CellRef]] = None) -> Dict[str, Any]:
+        """
+        Re-evaluate only the formulas affected by changes since the previous evaluation.
+        Unless changed_cells is given, changes are found by diffing against the rows passed to
+        the previous call, so pass fresh row dicts rather than editing them in place.
+        Falls back to a full evaluation when there is no usable previous state.
+        """
+        previous = self._last_input
+        if (previous is None or len(previous) != len(data) or self.circular_dependency_errors
+                or [column['key'] for column in columns] != self._last_column_keys):
+            return self.evaluate_formulas(data, columns, remember=True)
+        
+        try:
+            self._index_columns(columns)
+            if changed_cells is None:
+                changed_cells = self._diff_cells(previous, data, columns)
+            
+            graph = self.dependency_graph
+            new_data = list(self._last_output)
+            copied_rows = set()
+            
+            # Apply the changed inputs to the graph and the numeric snapshot
+            for cell_ref in changed_cells:
+                row_index = cell_ref.row - 1
+                col_idx = self._col_idx.get(cell_ref.column)
+                if col_idx is None or not 0 <= row_index < len(data):
+                    continue
+                
+                if row_index not in copied_rows:
+                    new_data[row_index] = new_data[row_index].copy()
+                    copied_rows.add(row_index)
+                value = data[row_index].get(cell_ref.column, '')
+                new_data[row_index][cell_ref.column] = value
+                if self._cell_errors:
+                    self._cell_errors.pop(f"{row_index}-{cell_ref.column}", None)
+                
+                if isinstance(value, str) and value.startswith('='):
+                    dependencies = self._formula_dependencies(value, data, columns)
+                    if not graph.add_formula(cell_ref, value, dependencies):
+                        # A new cycle needs the error reporting of a full evaluation
+                        return self.evaluate_formulas(data, columns, remember=True)
+                    self._matrix[col_idx][row_index] = 0.0
+                    self._filled[col_idx][row_index] = True
+                else:
+                    graph.remove_formula(cell_ref)
+                    graph.mark_dirty(cell_ref)
+                    self._matrix[col_idx][row_index] = self._get_numeric_value(value)
+                    self._filled[col_idx][row_index] = bool(value) and bool(str(value).strip())
+            
+            evaluation_order = graph.get_dirty_evaluation_order()
+            graph.clear_dirty_cells()
+            logger.info(f"Re-evaluating {len(evaluation_order)} of {len(graph.nodes)} formulas")
+            
+            self._copy_written_rows(evaluation_order, new_data, copied_rows)
+            evaluation_stats, cell_errors = self._evaluate_cells(evaluation_order, new_data, columns)
+            if self._cell_errors:
+                for cell_ref in evaluation_order:
+                    self._cell_errors.pop(f"{cell_ref.row - 1}-{cell_ref.column}", None)
+            self._remember_evaluation(data, new_data, columns, {**self._cell_errors, **cell_errors})
+            
+            return {
+                'success': True,
+                'data': new_data,
+                'message': f'Evaluated {evaluation_stats["evaluated"]} formulas successfully',
+                'cell_errors': dict(self._cell_errors),
+                'stats': {
+                    'evaluation': evaluation_stats,
+                    'graph': graph.get_graph_stats(),
+                    'evaluation_order': [str(cell) for cell in evaluation_order]
+                }
+            }
+        
+        except Exception as e:
+            logger.error(f"Error in evaluate_formulas_incremental: {str(e)}")
+            return self.evaluate_formulas(data, columns, remember=True)
+    
+    def _diff_cells(self, previous: List[Dict], data: List[Dict], columns: List[Dict]) -> Set[CellRef]:
+        """Find the cells whose input value differs from the previous call."""
+        changed = set()
+        for row_index, (old_row, row) in enumerate(zip(previous, data)):
+            if old_row is row or old_row == row:
+                continue
+            for column in columns:
+                key = column['key']
+                if old_row.get(key, '') != row.get(key, ''):
+                    changed.add(CellRef.make(key, row_index + 1))
+        return changed
+    
+    @staticmethod
+    def _copy_written_rows(evaluation_order: List[CellRef], new_data: List[Dict], copied_rows: Set[int]):
+        """Copy the rows results will be written to, the others stay shared with the input."""
+        for row_index in {cell_ref.row - 1 for cell_ref in evaluation_order} - copied_rows:
+            if 0 <= row_index < len(new_data):
+                new_data[row_index] = new_data[row_index].copy()
+    
+    def _remember_evaluation(self, data: List[Dict], new_data: List[Dict], columns: List[Dict],
+                             cell_errors: Dict[str, str]):
+        """Keep the state evaluate_formulas_incremental builds on."""
+        self._last_input = data
+        self._last_output = new_data
+        self._last_column_keys = [column['key'] for column in columns]
+        self._cell_errors = cell_errors
+    
+    def _evaluate_cells(self, evaluation_order: List[CellRef], new_data: List[Dict],
+                        columns: List[Dict]) -> Tuple[Dict[str, int], Dict[str, str]]:
+        """Evaluate the given formula cells in order, writing results into new_data and the snapshot."""
+        evaluation_stats = {'evaluated': 0, 'errors': 0, 'cached': 0}
+        cell_errors = {}  # Track individual cell errors
+        
+        for cell_ref in evaluation_order:
+            try:
+                node = self.dependency_graph.nodes[cell_ref]
+                
+                # Skip if already evaluated
+                if node.is_evaluated:
+                    evaluation_stats['cached'] += 1
+                    continue
+                
+                # Get the row and column
+                row_index = cell_ref.row - 1  # Convert to 0-based index
+                column_key = self._letter_to_column_key(cell_ref.column, columns)
+                
+                if row_index < 0 or row_index >= len(new_data) or not column_key:
+                    logger.warning(f"Invalid cell reference: {cell_ref}")
+                    cell_key = f"{row_index}-{cell_ref.column}"
+                    cell_errors[cell_key] = "Invalid cell reference"
+                    continue
+                
+                # Evaluate the formula: parsed when it was added to the graph, specialized to this cell here
+                formula_fn = self._specialize(node.compiled, row_index, new_data, columns)
+                result = self._run_formula(formula_fn, node.formula)
+                
+                col_idx = self._col_idx[column_key]
+                
+                # Update the result in data
+                if isinstance(result, str) and result.startswith('#'):
+                    # Error result
+                    new_data[row_index][column_key] = result
+                    self._matrix[col_idx][row_index] = 0.0
+                    self.dependency_graph.mark_cell_evaluated(cell_ref, result, has_error=True, error_message=result)
+                    cell_errors[f"{row_index}-{column_key}"] = result
+                    evaluation_stats['errors'] += 1
+                else:
+                    # Success result
+                    new_data[row_index][column_key] = self._format_number(result) if result is not None else '0'
+                    self._matrix[col_idx][row_index] = float(result) if result is not None else 0.0
+                    self.dependency_graph.mark_cell_evaluated(cell_ref, result, has_error=False)
+                    evaluation_stats['evaluated'] += 1
+                
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(f"Evaluated {cell_ref}: {node.formula} = {result}")
+                
+            except Exception as e:
+                logger.error(f"Error evaluating formula for cell {cell_ref}: {str(e)}")
+                row_index = cell_ref.row - 1
+                column_key = self._letter_to_column_key(cell_ref.column, columns)
+                cell_key = f"{row_index}-{column_key}" if column_key else f"{row_index}-{cell_ref.column}"
+                
+                if row_index < len(new_data) and column_key:
+                    new_data[row_index][column_key] = '#ERROR!'
+                    self._matrix[self._col_idx[column_key]][row_index] = 0.0
+                    self.dependency_graph.mark_cell_evaluated(cell_ref, '#ERROR!', has_error=True, error_message=str(e))
+                
+                cell_errors[cell_key] = str(e)
+                evaluation_stats['errors'] += 1
+        
+        return evaluation_stats, cell_errors
+    
+    def _index_columns(self, columns: List[Dict]):
+        """Index the column definitions by key; the first column wins on duplicates."""
+        self._col_idx = {}
+        self._col_by_letter = {}
+        for col_idx, column in enumerate(columns):
+            self._col_idx.setdefault(column['key'], col_idx)
+            self._col_by_letter.setdefault(column['key'], column)
+    
+    def _materialize(self, data: List[Dict], columns: List[Dict]):
+        """
+        Convert the row dicts once into per-column lists of floats that formulas read from.
+        Formula cells start at 0.0 and receive their value as they are evaluated.
+        """
+        get_numeric_value = self._get_numeric_value
+        self._matrix = []
+        self._filled = []
+        for column in columns:
+            key = column['key']
+            values = []
+            filled = []
+            append_value = values.append
+            append_filled = filled.append
+            for row in data:
+                value = row.get(key, '')
+                if type(value) is str and value.startswith('='):
+                    append_value(0.0)
+                    append_filled(True)
+                else:
+                    append_value(get_numeric_value(value))
+                    append_filled(bool(value) and bool(str(value).strip()))
+            self._matrix.append(values)
+            self._filled.append(filled)
+        self._row_count = len(data)
+    
     def _build_dependency_graph(self, data: List[Dict], columns: List[Dict]):
         try:
-            self.dependency_graph = DependencyGraph()
+            self.dependency_graph = DependencyGraph(compiler=_compile)
             self.circular_dependency_errors = {}  # Track circular dependency errors
             
+            # Collect all formulas first so the graph is only sorted once. One pass over each
+            # row's items finds its formula cells, which are then taken in column order.
+            col_idx = self._col_idx
+            make_cell_ref = CellRef.make
+            formula_dependencies = self._formula_dependencies
+            pending = []
             for row_index, row in enumerate(data):
-                for column in columns:
-                    cell_value = row.get(column['key'], '')
-                    if isinstance(cell_value, str) and cell_value.startswith('='):
-                        cell_ref = CellRef(column['key'], row_index + 1)
-                        dependencies = self.formula_parser.extract_dependencies(cell_value)
-                        # Map dependencies to actual column keys
-                        mapped_dependencies = set()
-                        for dep in dependencies:
-                            mapped_key = self._letter_to_column_key(dep.column, columns)
-                            if mapped_key:
-                                mapped_dependencies.add(CellRef(mapped_key, dep.row))
-                        valid_dependencies = self._validate_dependencies(mapped_dependencies, data, columns)
-                        success = self.dependency_graph.add_formula(cell_ref, cell_value, valid_dependencies)
-                        print(f"Adding formula {cell_value} for cell {cell_ref} with dependencies {valid_dependencies}")
-                        if not success:
-                            logger.warning(f"Failed to add formula {cell_value} for cell {cell_ref}")
-                            # Track the circular dependency error for frontend
-                            cell_key = f"{row_index}-{column['key']}"
-                            self.circular_dependency_errors[cell_key] = "Circular dependency detected"
-                            
+                formula_cells = [
+                    (col_idx[key], key, value) for key, value in row.items()
+                    if type(value) is str and value.startswith('=') and key in col_idx
+                ]
+                if not formula_cells:
+                    continue
+                if len(formula_cells) > 1:
+                    formula_cells.sort()
+                for _, column_key, cell_value in formula_cells:
+                    cell_ref = make_cell_ref(column_key, row_index + 1)
+                    valid_dependencies = formula_dependencies(cell_value, data, columns)
+                    pending.append((row_index, column_key, cell_ref, cell_value, valid_dependencies))
+            
+            results = self.dependency_graph.batch_add_formulas(
+                [(cell_ref, cell_value, deps) for _, _, cell_ref, cell_value, deps in pending]
+            )
+            for (row_index, column_key, cell_ref, cell_value, valid_dependencies), success in zip(pending, results):
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(f"Adding formula {cell_value} for cell {cell_ref} with dependencies {valid_dependencies}")
+                if not success:
+                    logger.warning(f"Failed to add formula {cell_value} for cell {cell_ref}")
+                    # Track the circular dependency error for frontend
+                    cell_key = f"{row_index}-{column_key}"
+                    self.circular_dependency_errors[cell_key] = "Circular dependency detected"
+            
             logger.info(f"Built dependency graph with {len(self.dependency_graph.nodes)} formula nodes")
         except Exception as e:
             logger.error(f"Error building dependency graph: {str(e)}")
             raise
 
+    def _formula_dependencies(self, formula: str, data: List[Dict], columns: List[Dict]) -> Set[CellRef]:
+        """Extract a formula's dependencies, mapped to column keys and checked against the sheet."""
+        dependencies = _extract_dependencies(self.formula_parser, formula)
+        # Map dependencies to actual column keys
+        mapped_dependencies = set()
+        for dep in dependencies:
+            mapped_key = self._letter_to_column_key(dep.column, columns)
+            if mapped_key:
+                mapped_dependencies.add(CellRef.make(mapped_key, dep.row))
+        return self._validate_dependencies(mapped_dependencies, data, columns)
+    
     def _find_column_by_letter(self, letter: str, columns_context: List[Dict]) -> Dict:
         """Find column definition by Excel-style letter (A, B, ...)."""
         # With the new system, the letter IS the column key
-        for column in columns_context:
-            if column.get('key') == letter:
-                return column
-        return None
+        return self._col_by_letter.get(letter)
 
     def _letter_to_column_key(self, letter: str, columns_context: List[Dict]) -> str:
         """Map Excel-style column letter to the actual column key."""
         # With the new system, the letter IS the column key
-        for column in columns_context:
-            if column.get('key') == letter:
-                return column['key']
-        return None
+        column = self._col_by_letter.get(letter)
+        return column['key'] if column else None
     
     def _validate_dependencies(self, dependencies: Set[CellRef], 
                              data: List[Dict], columns: List[Dict]) -> Set[CellRef]:
         """Validate that all dependencies exist in the current data."""
-        valid_deps = set()
+        row_count = len(data)
+        col_by_letter = self._col_by_letter
+        valid_deps = {dep for dep in dependencies if 1 <= dep.row <= row_count and dep.column in col_by_letter}
         
-        for dep in dependencies:
-            # Check if row exists
-            if dep.row < 1 or dep.row > len(data):
-                logger.warning(f"Dependency {dep} references non-existent row")
-                continue
-            
-            # Check if column exists
-            column_key = self._letter_to_column_key
-            if not column_key:
-                logger.warning(f"Dependency {dep} references non-existent column")
-                continue
-            
-            valid_deps.add(dep)
+        if len(valid_deps) != len(dependencies) and logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Dropped {len(dependencies) - len(valid_deps)} dependencies outside the sheet")
         
         return valid_deps
     
     def get_dependency_graph_info(self) -> Dict[str, Any]:
         """Get information about the current dependency graph."""
+        stats = self.dependency_graph.get_graph_stats()
         return {
-            'stats': self.dependency_graph.get_graph_stats(),
+            'stats': stats,
             'evaluation_order': [str(cell) for cell in self.dependency_graph.get_evaluation_order()],
             'dirty_cells': [str(cell) for cell in self.dependency_graph.get_dirty_cells()],
-            'has_cycles': self.dependency_graph.has_circular_dependency()[0]
+            'has_cycles': stats['has_cycles']
         }
     
-    # Include all the helper methods from the original engine
-    def _evaluate_formula(self, formula: str, current_row: int, current_col: str, 
-                         data_context: List[Dict], columns_context: List[Dict]) -> Union[float, str]:
-        """Evaluate a single formula (same logic as original engine)."""
+    def _specialize(self, node: tuple, current_row: int,
+                    data_context: List[Dict], columns_context: List[Dict]) -> Callable[[], Any]:
+        """
+        Turn a formula AST into a zero-argument closure for one cell. Column lookups, bounds
+        checks and function dispatch are resolved here once, so running it only does the math.
+        """
+        tag = node[0]
+        if tag == 'num':
+            value = node[1]
+            return lambda: value
+        if tag == 'cell':
+            col_idx = self._col_idx.get(node[1])
+            row_index = node[2]
+            if col_idx is None or row_index < 0 or row_index >= self._row_count:
+                return lambda: 0
+            column = self._matrix[col_idx]
+            return lambda: column[row_index]
+        if tag == 'bin':
+            # The parser builds operator chains left-deep, so walk down the left spine of
+            # same-precedence operators and run A1+A2-...+An as one flat closure
+            operators = '+-' if node[1] in '+-' else '*/'
+            steps = []
+            while node[0] == 'bin' and node[1] in operators:
+                steps.append((node[1], self._specialize(node[3], current_row, data_context, columns_context)))
+                node = node[2]
+            first = self._specialize(node, current_row, data_context, columns_context)
+            steps.reverse()
+            
+            if len(steps) == 1:
+                left = first
+                operator, right = steps[0]
+                if operator == '+':
+                    return lambda: left() + right()
+                if operator == '-':
+                    return lambda: left() - right()
+                if operator == '*':
+                    return lambda: left() * right()
+                return lambda: left() / right()
+            
+            # True where the step adds (or multiplies), False where it subtracts (or divides)
+            steps = tuple((operator in '+*', operand) for operator, operand in steps)
+            if operators == '+-':
+                def chain():
+                    total = first()
+                    for adds, operand in steps:
+                        if adds:
+                            total += operand()
+                        else:
+                            total -= operand()
+                    return total
+            else:
+                def chain():
+                    total = first()
+                    for multiplies, operand in steps:
+                        if multiplies:
+                            total *= operand()
+                        else:
+                            total /= operand()
+                    return total
+            return chain
+        if tag == 'neg':
+            operand = self._specialize(node[1], current_row, data_context, columns_context)
+            return lambda: -operand()
+        if tag == 'func':
+            function = self.functions.get(node[1])
+            if function is None:
+                return _raiser('#NAME?')  # Unknown function
+            args_str = node[2]
+            
+            def call():
+                result = function(args_str, current_row, data_context, columns_context)
+                if isinstance(result, str):
+                    raise FormulaError(result)
+                return result
+            return call
+        return _raiser(node[1])
+    
+    def _run_formula(self, formula_fn: Callable[[], Any], formula: str) -> Union[float, str]:
+        """Run a specialized formula, mapping failures to Excel-style error strings."""
         try:
-            # Remove the = sign and convert to uppercase
-            expression = formula[1:].upper().strip()
-            
-            if not expression:
-                return '#ERROR!'
-            
-            # Handle function calls (SUM, AVERAGE, etc.)
-            func_match = re.match(r'([A-Z]+)\(([^)]+)\)', expression)
-            if func_match:
-                func_name, args = func_match.groups()
-                if func_name in self.functions:
-                    return self.functions[func_name](args, current_row, data_context, columns_context)
-                else:
-                    return f'#NAME?'  # Unknown function
-            
-            # Handle cell references (A1, B2, etc.)
-            cell_ref_match = re.match(r'^([A-Z]+)(\d+)$', expression)
-            if cell_ref_match:
-                col_ref, row_ref = cell_ref_match.groups()
-                return self._get_cell_value(col_ref, int(row_ref) - 1, data_context, columns_context)
-            
-            # Handle arithmetic expressions (A1+B1, A1*2, etc.)
-            arithmetic_match = re.match(r'^(.+?)([\+\-\*\/])(.+?)$', expression)
-            if arithmetic_match:
-                left, operator, right = arithmetic_match.groups()
-                left_value = self._parse_value(left.strip(), current_row, data_context, columns_context)
-                right_value = self._parse_value(right.strip(), current_row, data_context, columns_context)
-                
-                return self._perform_arithmetic(left_value, operator, right_value)
-            
-            # Try to parse as a number
-            try:
-                return float(expression)
-            except ValueError:
-                return '#ERROR!'
-                
+            return formula_fn()
+        except ZeroDivisionError:
+            return '#DIV/0!'
+        except FormulaError as e:
+            return e.code
         except Exception as e:
             logger.error(f"Error evaluating formula '{formula}': {str(e)}")
             return '#ERROR!'
@@ -298,51 +683,21 @@ class EnhancedFormulaEngine:
             args_str = args_str.strip()
             
             # Check if it's a range (A1:A5 or A1:C1)
-            range_match = re.match(r'^([A-Z]+)(\d+):([A-Z]+)(\d+)$', args_str)
-            if range_match:
-                start_col, start_row, end_col, end_row = range_match.groups()
-                start_row_idx = int(start_row) - 1
-                end_row_idx = int(end_row) - 1
-                
-                total = 0
-                
-                # Convert column letters to indices
-                start_col_idx = ord(start_col) - ord('A')
-                end_col_idx = ord(end_col) - ord('A')
-                
-                # Iterate through all cells in the range
-                for row_idx in range(start_row_idx, min(end_row_idx + 1, len(data_context))):
-                    if row_idx >= 0:
-                        for col_idx in range(start_col_idx, end_col_idx + 1):
-                            col_letter = chr(ord('A') + col_idx)
-                            value = self._get_cell_value(col_letter, row_idx, data_context, columns_context)
-                            total += value
-                
-                return total
+            parsed_range = self._parse_range(args_str)
+            if parsed_range:
+                start_col, end_col, row_slice, _ = parsed_range
+                return self._sum_range(start_col, end_col, row_slice)
             
             # Handle comma-separated values (A1,B1,C1)
             if ',' in args_str:
-                total = 0
-                cell_refs = [ref.strip() for ref in args_str.split(',')]
-                for cell_ref in cell_refs:
-                    cell_match = re.match(r'^([A-Z]+)(\d+)$', cell_ref)
-                    if cell_match:
-                        col_ref, row_ref = cell_match.groups()
-                        row_idx = int(row_ref) - 1
-                        value = self._get_cell_value(col_ref, row_idx, data_context, columns_context)
-                        total += value
-                    else:
-                        # Try to parse as a number
-                        try:
-                            total += float(cell_ref)
-                        except ValueError:
-                            logger.error(f"Invalid cell reference or number: {cell_ref}")
-                            return '#ERROR!'
-                
-                return total
+                items = _parse_arg_list(args_str)
+                if items is None:
+                    logger.error(f"Invalid cell reference or number in: {args_str}")
+                    return '#ERROR!'
+                return self._sum_items(items, data_context, columns_context)
             
             # Single cell reference
-            cell_match = re.match(r'^([A-Z]+)(\d+)$', args_str)
+            cell_match = _CELL_RE.fullmatch(args_str)
             if cell_match:
                 col_ref, row_ref = cell_match.groups()
                 row_idx = int(row_ref) - 1
@@ -365,38 +720,25 @@ class EnhancedFormulaEngine:
         try:
             args_str = args_str.strip()
             
-            # Check if it's a range (A1:A5 or A1:C1)
-            range_match = re.match(r'^([A-Z]+)(\d+):([A-Z]+)(\d+)$', args_str)
-            if range_match:
-                sum_result = self._calculate_sum(args_str, current_row, data_context, columns_context)
-                if isinstance(sum_result, str):  # Error occurred
-                    return sum_result
-                
-                start_col, start_row, end_col, end_row = range_match.groups()
-                # Calculate the number of cells in the range
-                start_col_idx = ord(start_col) - ord('A')
-                end_col_idx = ord(end_col) - ord('A')
-                start_row_idx = int(start_row)
-                end_row_idx = int(end_row)
-                
-                num_cols = end_col_idx - start_col_idx + 1
-                num_rows = end_row_idx - start_row_idx + 1
-                count = num_cols * num_rows
-                
+            # Check if it's a range (A1:A5 or A1:C1), the average is over all cells it spans
+            parsed_range = self._parse_range(args_str)
+            if parsed_range:
+                start_col, end_col, row_slice, num_rows = parsed_range
+                count = (ord(end_col) - ord(start_col) + 1) * num_rows
+                sum_result = self._sum_range(start_col, end_col, row_slice)
                 return sum_result / count if count > 0 else '#DIV/0!'
             
             # Handle comma-separated values (A1,B1,C1)
             if ',' in args_str:
-                sum_result = self._calculate_sum(args_str, current_row, data_context, columns_context)
-                if isinstance(sum_result, str):  # Error occurred
-                    return sum_result
-                
-                cell_refs = [ref.strip() for ref in args_str.split(',')]
-                count = len(cell_refs)
-                return sum_result / count if count > 0 else '#DIV/0!'
+                items = _parse_arg_list(args_str)
+                if items is None:
+                    logger.error(f"Invalid cell reference or number in: {args_str}")
+                    return '#ERROR!'
+                sum_result = self._sum_items(items, data_context, columns_context)
+                return sum_result / len(items)
             
             # Single cell reference
-            cell_match = re.match(r'^([A-Z]+)(\d+)$', args_str)
+            cell_match = _CELL_RE.fullmatch(args_str)
             if cell_match:
                 return self._calculate_sum(args_str, current_row, data_context, columns_context)
             
@@ -415,24 +757,16 @@ class EnhancedFormulaEngine:
                       data_context: List[Dict], columns_context: List[Dict]) -> Union[float, str]:
         """Calculate MIN for a range"""
         try:
-            range_match = re.match(r'^([A-Z]+)(\d+):([A-Z]+)(\d+)$', range_str.strip())
-            if not range_match:
+            parsed_range = self._parse_range(range_str)
+            if not parsed_range:
                 return '#ERROR!'
             
-            start_col, start_row, end_col, end_row = range_match.groups()
-            start_row_idx = int(start_row) - 1
-            end_row_idx = int(end_row) - 1
-            
-            column = self._find_column_by_letter(start_col, columns_context)
-            if not column:
+            start_col, _, row_slice, _ = parsed_range
+            col_idx = self._col_idx.get(start_col)
+            if col_idx is None:
                 return '#ERROR!'
             
-            values = []
-            for i in range(start_row_idx, min(end_row_idx + 1, len(data_context))):
-                if i >= 0:
-                    value = self._get_numeric_value(data_context[i].get(column['key'], 0))
-                    values.append(value)
-            
+            values = self._matrix[col_idx][row_slice]
             return min(values) if values else 0
             
         except Exception as e:
@@ -443,24 +777,16 @@ class EnhancedFormulaEngine:
                       data_context: List[Dict], columns_context: List[Dict]) -> Union[float, str]:
         """Calculate MAX for a range"""
         try:
-            range_match = re.match(r'^([A-Z]+)(\d+):([A-Z]+)(\d+)$', range_str.strip())
-            if not range_match:
+            parsed_range = self._parse_range(range_str)
+            if not parsed_range:
                 return '#ERROR!'
             
-            start_col, start_row, end_col, end_row = range_match.groups()
-            start_row_idx = int(start_row) - 1
-            end_row_idx = int(end_row) - 1
-
-            column = self._find_column_by_letter(start_col, columns_context)
-            if not column:
+            start_col, _, row_slice, _ = parsed_range
+            col_idx = self._col_idx.get(start_col)
+            if col_idx is None:
                 return '#ERROR!'
             
-            values = []
-            for i in range(start_row_idx, min(end_row_idx + 1, len(data_context))):
-                if i >= 0:
-                    value = self._get_numeric_value(data_context[i].get(column['key'], 0))
-                    values.append(value)
-            
+            values = self._matrix[col_idx][row_slice]
             return max(values) if values else 0
             
         except Exception as e:
@@ -471,106 +797,89 @@ class EnhancedFormulaEngine:
                         data_context: List[Dict], columns_context: List[Dict]) -> Union[float, str]:
         """Calculate COUNT for a range"""
         try:
-            range_match = re.match(r'^([A-Z]+)(\d+):([A-Z]+)(\d+)$', range_str.strip())
-            if not range_match:
+            parsed_range = self._parse_range(range_str)
+            if not parsed_range:
                 return '#ERROR!'
             
-            start_col, start_row, end_col, end_row = range_match.groups()
-            start_row_idx = int(start_row) - 1
-            end_row_idx = int(end_row) - 1
-
-            column = self._find_column_by_letter(start_col, columns_context)
-            if not column:
+            start_col, _, row_slice, _ = parsed_range
+            col_idx = self._col_idx.get(start_col)
+            if col_idx is None:
                 return '#ERROR!'
             
-            count = 0
-            for i in range(start_row_idx, min(end_row_idx + 1, len(data_context))):
-                if i >= 0:
-                    value = data_context[i].get(column['key'], '')
-                    if value and str(value).strip():  # Count non-empty cells
-                        count += 1
-            
-            return count
+            # Count non-empty cells
+            return self._filled[col_idx][row_slice].count(True)
             
         except Exception as e:
             logger.error(f"Error in _calculate_count: {str(e)}")
             return '#ERROR!'
     
+    def _parse_range(self, range_str: str) -> Optional[Tuple[str, str, slice, int]]:
+        """
+        Parse a range like A1:C5 into its start and end columns, the row slice it covers
+        and the number of rows it spans.
+        """
+        range_match = _RANGE_RE.fullmatch(range_str.strip())
+        if not range_match:
+            return None
+        start_col, start_row, end_col, end_row = range_match.groups()
+        start_row, end_row = int(start_row), int(end_row)
+        # Rows before the sheet are skipped, slicing already clips rows past the end
+        return start_col, end_col, slice(max(start_row - 1, 0), end_row), end_row - start_row + 1
+    
+    def _sum_range(self, start_col: str, end_col: str, row_slice: slice) -> float:
+        """Sum a range one column slice at a time, columns missing from the sheet count as 0"""
+        total = 0
+        for col_code in range(ord(start_col), ord(end_col) + 1):
+            col_idx = self._col_idx.get(chr(col_code))
+            if col_idx is not None:
+                total += sum(self._matrix[col_idx][row_slice])
+        return total
+    
+    def _sum_items(self, items: tuple, data_context: List[Dict], columns_context: List[Dict]) -> float:
+        """Sum parsed comma-separated arguments: (column, row_index) references and numbers"""
+        total = 0
+        for item in items:
+            if type(item) is tuple:
+                total += self._get_cell_value(item[0], item[1], data_context, columns_context)
+            else:
+                total += item
+        return total
+    
     # Copy all helper methods from original engine
     def _get_cell_value(self, col_ref: str, row_index: int,
                        data_context: List[Dict], columns_context: List[Dict]) -> float:
-        """Get value from a specific cell reference"""
-        try:
-            if row_index < 0 or row_index >= len(data_context):
-                return 0
-
-            column = self._find_column_by_letter(col_ref, columns_context)
-            if not column:
-                return 0
-            
-            value = data_context[row_index].get(column['key'], 0)
-            return self._get_numeric_value(value)
-            
-        except Exception as e:
-            logger.error(f"Error in _get_cell_value: {str(e)}")
+        """Get value from a specific cell reference in the materialized matrix"""
+        if row_index < 0 or row_index >= self._row_count:
             return 0
-    
-    def _parse_value(self, value: str, current_row: int,
-                    data_context: List[Dict], columns_context: List[Dict]) -> float:
-        """Parse a value that could be a cell reference or number"""
-        try:
-            # Check if it's a cell reference
-            cell_ref_match = re.match(r'^([A-Z]+)(\d+)$', value)
-            if cell_ref_match:
-                col_ref, row_ref = cell_ref_match.groups()
-                return self._get_cell_value(col_ref, int(row_ref) - 1, data_context, columns_context)
-            
-            # Try to parse as number
-            return self._get_numeric_value(value)
-            
-        except Exception as e:
-            logger.error(f"Error in _parse_value: {str(e)}")
+
+        col_idx = self._col_idx.get(col_ref)
+        if col_idx is None:
             return 0
-    
-    def _perform_arithmetic(self, left: float, operator: str, right: float) -> Union[float, str]:
-        """Perform arithmetic operation"""
-        try:
-            if operator == '+':
-                return left + right
-            elif operator == '-':
-                return left - right
-            elif operator == '*':
-                return left * right
-            elif operator == '/':
-                return left / right if right != 0 else '#DIV/0!'
-            else:
-                return '#ERROR!'
-        except Exception as e:
-            logger.error(f"Error in arithmetic operation: {str(e)}")
-            return '#ERROR!'
-    
-    def _find_column_by_title(self, title: str, columns_context: List[Dict]) -> Dict:
-        """Find column definition by title"""
-        for column in columns_context:
-            if column.get('title') == title:
-                return column
-        return None
-    
-    def _get_column_key_by_title(self, title: str, columns_context: List[Dict]) -> str:
-        """Get column key by title"""
-        column = self._find_column_by_title(title, columns_context)
-        return column['key'] if column else None
+        
+        return self._matrix[col_idx][row_index]
     
     def _get_numeric_value(self, value: Any) -> float:
         """Convert value to numeric, return 0 if not possible"""
-        try:
-            if isinstance(value, (int, float)):
+        value_type = type(value)
+        if value_type is float:
+            return value
+        if value_type is str:
+            return self._coerce_str(value)
+        if isinstance(value, (int, float)):
+            try:
                 return float(value)
-            elif isinstance(value, str):
-                # Remove any non-numeric characters except decimal point and minus
-                cleaned = re.sub(r'[^\d\.\-]', '', value)
-                return float(cleaned) if cleaned else 0
-            else:
+            except OverflowError:
+                # Integers past the float range read as 0, so one cell cannot fail the sheet
                 return 0
-        except (ValueError, TypeError):
-            return 0
\ No newline at end of file
+        return 0
+    
+    @staticmethod
+    @lru_cache(maxsize=8192)
+    def _coerce_str(value: str) -> float:
+        """Convert a cell string to numeric; memoized since sheets repeat the same strings a lot"""
+        # Remove any non-numeric characters except decimal point and minus
+        cleaned = _NUM_CLEAN_RE.sub('', value)
+        try:
+            return float(cleaned) if cleaned else 0
+        except ValueError:
+            return 0
@@ -4,11 +4,154 @@ Supports Excel-style formulas including SUM, AVERAGE, cell references, and arith
 """
 
 import re
+import math
 import logging
-from typing import Dict, List, Any, Union, Tuple
+import operator
+from functools import lru_cache
+from typing import Dict, List, Any, Union, Tuple, Optional
 
 logger = logging.getLogger(__name__)
 
+# Compiled once at import instead of looked up in re's cache on every call
+# One alternation covering every token, tried left to right by _to_rpn. Patterns
+# ignore case so formulas are not upper-cased whole, only the captured names are
+_TOKEN_RE = re.compile(
+    r'\s*(?:'
+    r'(?P<num>(?:\d+\.?\d*|\.\d+)(?:E[+-]?\d+)?)'
+    r'|(?P<func>[A-Z]+)\((?P<args>[^)]*)\)'
+    r'|(?P<col>[A-Z]+)(?P<row>\d+)'
+    r'|(?P<op>[+\-*/])'
+    r'|(?P<lp>\()'
+    r'|(?P<rp>\))'
+    r'|(?P<bad>\S))',
+    re.IGNORECASE
+)
+_RANGE_RE = re.compile(r'^([A-Z]+)(\d+):([A-Z]+)(\d+)$', re.IGNORECASE)
+_NUM_CLEAN_RE = re.compile(r'[^\d\.\-]')
+# A cell reference, split on to lift row numbers out of a formula into a template
+# The lookbehind keeps the exponent of a dotted float such as 1.E5 from reading as cell E5
+_CELL_SPLIT_RE = re.compile(r'(?<![\d.])\b([A-Z]+)(\d+)\b', re.IGNORECASE)
+
+_PRECEDENCE = {'+': 1, '-': 1, '*': 2, '/': 2, 'neg': 3}
+
+
+def _safe_div(left: float, right: float) -> Union[float, str]:
+    """Divide, giving the Excel error instead of raising on a zero divisor"""
+    return left / right if right != 0 else '#DIV/0!'
+
+
+# Binary operators by symbol, looked up once per step instead of comparing symbols
+_OPS = {'+': operator.add, '-': operator.sub, '*': operator.mul, '/': _safe_div}
+
+
+@lru_cache(maxsize=4096)
+def _to_rpn(expression: str) -> Optional[Tuple[Tuple[str, Any], ...]]:
+    """
+    Tokenize an expression in one pass and reorder it into
+    reverse Polish notation with the shunting-yard algorithm.
+    
+    Operands are ('num', value), ('cell', (col, row_index)) and
+    ('func', (name, args)), operators are ('op', symbol), ('neg', None) and
+    the n-ary ('sum', n) / ('prod', n) built by _fold_chains.
+    Returns None when the expression is malformed.
+    """
+    output = []
+    stack = []
+    expect_operand = True
+    
+    for match in _TOKEN_RE.finditer(expression):
+        kind = match.lastgroup
+        if kind in ('num', 'row', 'args'):
+            if not expect_operand:
+                return None
+            if kind == 'num':
+                output.append(('num', float(match.group('num'))))
+            elif kind == 'row':
+                output.append(('cell', (match.group('col').upper(), int(match.group('row')) - 1)))
+            else:
+                output.append(('func', (match.group('func').upper(), match.group('args'))))
+            expect_operand = False
+        elif kind == 'op':
+            operator = match.group('op')
+            if expect_operand:
+                # A sign in operand position is unary, a leading + is a no-op
+                if operator == '-':
+                    stack.append('neg')
+                elif operator != '+':
+                    return None
+                continue
+            while stack and stack[-1] != '(' and _PRECEDENCE[stack[-1]] >= _PRECEDENCE[operator]:
+                top = stack.pop()
+                output.append(('neg', None) if top == 'neg' else ('op', top))
+            stack.append(operator)
+            expect_operand = True
+        elif kind == 'lp':
+            if not expect_operand:
+                return None
+            stack.append('(')
+        elif kind == 'rp':
+            if expect_operand:
+                return None
+            while stack and stack[-1] != '(':
+                top = stack.pop()
+                output.append(('neg', None) if top == 'neg' else ('op', top))
+            if not stack:
+                return None
+            stack.pop()
+        else:
+            return None
+    
+    if expect_operand:
+        return None
+    while stack:
+        top = stack.pop()
+        if top == '(':
+            return None
+        output.append(('neg', None) if top == 'neg' else ('op', top))
+    return _fold_chains(output)
+
+
+@lru_cache(maxsize=4096)
+def _template_rpn(template: str) -> Optional[Tuple[Tuple[str, Any], ...]]:
+    """
+    RPN of a formula template, whose n cell references carry the slot
+    numbers 1..n as rows, so a ('cell', (col, k)) step reads slot k.
+    Returns None when the template cannot be used as is, either because it
+    is malformed or because function arguments are kept as text and would
+    hold the slot numbers instead of the real rows.
+    """
+    rpn = _to_rpn(template)
+    if rpn is None or any(kind == 'func' for kind, _ in rpn):
+        return None
+    return rpn
+
+
+def _fold_chains(rpn: List[Tuple[str, Any]]) -> Tuple[Tuple[str, Any], ...]:
+    """
+    Merge left-nested chains of + or * into one ('sum', n) or ('prod', n)
+    step, so A1+A2+...+An is a single builtin call over n stack values.
+    """
+    output = []
+    ends = []  # Index in output of the token producing each pending value
+    for kind, value in rpn:
+        if kind == 'op':
+            right_end = ends.pop()
+            left_end = ends.pop()
+            if value in '+*':
+                chain = 'sum' if value == '+' else 'prod'
+                left = output[left_end]
+                if left[0] == chain:
+                    # The left operand's own chain step is absorbed into this one
+                    output[left_end] = None
+                    kind, value = chain, left[1] + 1
+                else:
+                    kind, value = chain, 2
+        elif kind == 'neg':
+            ends.pop()
+        output.append((kind, value))
+        ends.append(len(output) - 1)
+    return tuple(token for token in output if token is not None)
+
 
 class FormulaEngine:
     """
@@ -20,6 +163,9 @@ class FormulaEngine:
             'SUM': self._calculate_sum,
             'AVERAGE': self._calculate_average,
         }
+        self._col_by_title: Dict[str, Dict] = {}
+        self._numeric_columns: Dict[str, List[float]] = {}
+        self._expr_cache: Dict[str, Union[float, str]] = {}
     
     def evaluate_formulas(self, data: List[Dict], columns: List[Dict]) -> Dict[str, Any]:
         """
@@ -33,26 +179,21 @@ class FormulaEngine:
             Dictionary with success status and processed data
         """
         try:
-            new_data = []
+            # Index columns by title once, the first column wins on duplicate titles
+            self._col_by_title = {}
+            for column in columns:
+                self._col_by_title.setdefault(column.get('title'), column)
+            self._numeric_columns = {}
+            self._expr_cache = {}
             
-            for row_index, row in enumerate(data):
-                new_row = row.copy()
-                
-                for column in columns:
-                    cell_value = row.get(column['key'], '')
-                    
-                    if isinstance(cell_value, str) and cell_value.startswith('='):
-                        try:
-                            result = self._evaluate_formula(
-                                cell_value, row_index, column['key'], data, columns
-                            )
-                            new_row[column['key']] = str(result) if result is not None else '#ERROR!'
-                            logger.info(f"Formula '{cell_value}' evaluated to: {result}")
-                        except Exception as e:
-                            logger.error(f"Error evaluating formula '{cell_value}': {str(e)}")
-                            new_row[column['key']] = '#ERROR!'
-                
-                new_data.append(new_row)
+            # Rows only read the input data, so each one is evaluated on its own
+            keys = [column['key'] for column in columns]
+            log_results = logger.isEnabledFor(logging.INFO)
+            evaluate_row = self._evaluate_row
+            new_data = [
+                evaluate_row(row_index, row, keys, data, columns, log_results)
+                for row_index, row in enumerate(data)
+            ]
             
             return {
                 'success': True,
@@ -68,6 +209,32 @@ class FormulaEngine:
                 'message': 'Failed to evaluate formulas'
             }
     
+    def _evaluate_row(self, row_index: int, row: Dict, keys: List[str], data: List[Dict],
+                      columns: List[Dict], log_results: bool) -> Dict:
+        """Evaluate the formulas of one row, rows without formulas are passed through"""
+        new_row = row
+        
+        for key in keys:
+            cell_value = row.get(key, '')
+            
+            # Input comes from JSON, so formula text is always an exact str
+            if type(cell_value) is str and cell_value[:1] == '=':
+                # Only written rows are copied
+                if new_row is row:
+                    new_row = row.copy()
+                try:
+                    result = self._evaluate_formula(
+                        cell_value, row_index, key, data, columns
+                    )
+                    new_row[key] = str(result) if result is not None else '#ERROR!'
+                    if log_results:
+                        logger.info(f"Formula '{cell_value}' evaluated to: {result}")
+                except Exception as e:
+                    logger.error(f"Error evaluating formula '{cell_value}': {str(e)}")
+                    new_row[key] = '#ERROR!'
+        
+        return new_row
+    
     def _evaluate_formula(self, formula: str, current_row: int, current_col: str, 
                          data_context: List[Dict], columns_context: List[Dict]) -> Union[float, str]:
         """
@@ -84,51 +251,53 @@ class FormulaEngine:
             Evaluated result or error string
         """
         try:
-            # Remove the = sign and convert to uppercase
-            expression = formula[1:].upper().strip()
+            # Remove the = sign, case is left to the tokenizer
+            expression = formula[1:].strip()
             
             if not expression:
                 return '#ERROR!'
             
-            # Handle function calls (SUM, AVERAGE, etc.)
-            func_match = re.match(r'([A-Z]+)\(([^)]+)\)', expression)
-            if func_match:
-                func_name, args = func_match.groups()
-                if func_name in self.functions:
-                    return self.functions[func_name](args, current_row, data_context, columns_context)
-                else:
-                    return f'#NAME?'  # Unknown function
-            
-            # Handle cell references (A1, B2, etc.)
-            cell_ref_match = re.match(r'^([A-Z]+)(\d+)$', expression)
-            if cell_ref_match:
-                col_ref, row_ref = cell_ref_match.groups()
-                return self._get_cell_value(col_ref, int(row_ref) - 1, data_context, columns_context)
-            
-            # Handle arithmetic expressions (A1+B1, A1*2, etc.)
-            arithmetic_match = re.match(r'^(.+?)([\+\-\*\/])(.+?)$', expression)
-            if arithmetic_match:
-                left, operator, right = arithmetic_match.groups()
-                left_value = self._parse_value(left.strip(), current_row, data_context, columns_context)
-                right_value = self._parse_value(right.strip(), current_row, data_context, columns_context)
+            # References are absolute and read the input data, so an expression
+            # evaluates the same way in every cell of one evaluate_formulas call
+            result = self._expr_cache.get(expression)
+            if result is None:
+                result = self._evaluate_expression(expression, current_row, data_context, columns_context)
+                self._expr_cache[expression] = result
+            return result
                 
-                return self._perform_arithmetic(left_value, operator, right_value)
+        except Exception as e:
+            logger.error(f"Error evaluating formula '{formula}': {str(e)}")
+            return '#ERROR!'
+    
+    def _evaluate_expression(self, expression: str, current_row: int,
+                             data_context: List[Dict], columns_context: List[Dict]) -> Union[float, str]:
+        """Evaluate a formula body without the leading ="""
+        try:
+            # A column of =A1+B1*2, =A2+B2*2, ... shares one template and is parsed once,
+            # the split gives [text, col, row, text, col, row, ..., text]
+            parts = _CELL_SPLIT_RE.split(expression)
+            rows = parts[2::3]
+            if rows:
+                parts[2::3] = map(str, range(1, len(rows) + 1))
+                rpn = _template_rpn(''.join(parts))
+                if rpn is not None:
+                    rows = [int(row) - 1 for row in rows]
+                    return self._evaluate_rpn(rpn, current_row, data_context, columns_context, rows)
             
-            # Try to parse as a number
-            try:
-                return float(expression)
-            except ValueError:
+            rpn = _to_rpn(expression)
+            if rpn is None:
                 return '#ERROR!'
+            return self._evaluate_rpn(rpn, current_row, data_context, columns_context)
                 
         except Exception as e:
-            logger.error(f"Error evaluating formula '{formula}': {str(e)}")
+            logger.error(f"Error evaluating formula '={expression}': {str(e)}")
             return '#ERROR!'
     
     def _calculate_sum(self, range_str: str, current_row: int, 
                       data_context: List[Dict], columns_context: List[Dict]) -> Union[float, str]:
         """Calculate SUM for a range like A1:A5"""
         try:
-            range_match = re.match(r'^([A-Z]+)(\d+):([A-Z]+)(\d+)$', range_str.strip())
+            range_match = _RANGE_RE.match(range_str.strip())
             if not range_match:
                 return '#ERROR!'
             
@@ -137,16 +306,15 @@ class FormulaEngine:
             end_row_idx = int(end_row) - 1
             
             # Find the column
-            column = self._find_column_by_title(start_col, columns_context)
+            column = self._find_column_by_title(start_col.upper(), columns_context)
             if not column:
                 return '#ERROR!'
             
-            total = 0
-            for i in range(start_row_idx, min(end_row_idx + 1, len(data_context))):
-                value = self._get_numeric_value(data_context[i].get(column['key'], 0))
-                total += value
-            
-            return total
+            values = self._numeric_column(column, data_context)
+            if start_row_idx >= 0:
+                return sum(values[start_row_idx:end_row_idx + 1])
+            # Row 0 indexes from the end, keep that by walking the indices
+            return sum(map(values.__getitem__, range(start_row_idx, min(end_row_idx + 1, len(values)))))
             
         except Exception as e:
             logger.error(f"Error in _calculate_sum: {str(e)}")
@@ -160,7 +328,7 @@ class FormulaEngine:
             if isinstance(sum_result, str):  # Error occurred
                 return sum_result
             
-            range_match = re.match(r'^([A-Z]+)(\d+):([A-Z]+)(\d+)$', range_str.strip())
+            range_match = _RANGE_RE.match(range_str.strip())
             if not range_match:
                 return '#ERROR!'
             
@@ -173,75 +341,97 @@ class FormulaEngine:
             logger.error(f"Error in _calculate_average: {str(e)}")
             return '#ERROR!'
     
-    def _get_cell_value(self, col_ref: str, row_index: int,
-                       data_context: List[Dict], columns_context: List[Dict]) -> float:
-        """Get value from a specific cell reference"""
-        try:
-            if row_index < 0 or row_index >= len(data_context):
-                return 0
-            
-            column = self._find_column_by_title(col_ref, columns_context)
-            if not column:
-                return 0
-            
-            value = data_context[row_index].get(column['key'], 0)
-            return self._get_numeric_value(value)
-            
-        except Exception as e:
-            logger.error(f"Error in _get_cell_value: {str(e)}")
-            return 0
+    def _numeric_column(self, column: Dict, data_context: List[Dict]) -> List[float]:
+        """Numeric values of a column, converted once per evaluation and shared by all ranges"""
+        key = column['key']
+        values = self._numeric_columns.get(key)
+        if values is None:
+            get_numeric = self._get_numeric_value
+            values = [get_numeric(row.get(key, 0)) for row in data_context]
+            self._numeric_columns[key] = values
+        return values
     
-    def _parse_value(self, value: str, current_row: int,
-                    data_context: List[Dict], columns_context: List[Dict]) -> float:
-        """Parse a value that could be a cell reference or number"""
-        try:
-            # Check if it's a cell reference
-            cell_ref_match = re.match(r'^([A-Z]+)(\d+)$', value)
-            if cell_ref_match:
-                col_ref, row_ref = cell_ref_match.groups()
-                return self._get_cell_value(col_ref, int(row_ref) - 1, data_context, columns_context)
-            
-            # Try to parse as number
-            return self._get_numeric_value(value)
-            
-        except Exception as e:
-            logger.error(f"Error in _parse_value: {str(e)}")
+    def _cell_token_value(self, col_ref: str, row_index: int, data_context: List[Dict]) -> float:
+        """
+        Value of a cell the tokenizer already split into column and row index,
+        read from the column's converted numbers instead of the raw row
+        """
+        if row_index < 0 or row_index >= len(data_context):
+            return 0
+        column = self._col_by_title.get(col_ref)
+        if not column:
             return 0
+        return self._numeric_column(column, data_context)[row_index]
     
-    def _perform_arithmetic(self, left: float, operator: str, right: float) -> Union[float, str]:
-        """Perform arithmetic operation"""
-        try:
-            if operator == '+':
-                return left + right
-            elif operator == '-':
-                return left - right
-            elif operator == '*':
-                return left * right
-            elif operator == '/':
-                return left / right if right != 0 else '#DIV/0!'
+    def _evaluate_rpn(self, rpn: Tuple[Tuple[str, Any], ...], current_row: int,
+                      data_context: List[Dict], columns_context: List[Dict],
+                      rows: Optional[List[int]] = None) -> Union[float, str]:
+        """
+        Run a token sequence from _to_rpn on a value stack, error strings propagate.
+        For a template from _template_rpn, rows holds the row index of each slot.
+        """
+        stack = []
+        for kind, value in rpn:
+            if kind == 'num':
+                stack.append(value)
+            elif kind == 'cell':
+                row_index = value[1] if rows is None else rows[value[1]]
+                stack.append(self._cell_token_value(value[0], row_index, data_context))
+            elif kind == 'func':
+                func_name, args = value
+                function = self.functions.get(func_name)
+                if function is None:
+                    stack.append('#NAME?')  # Unknown function
+                else:
+                    stack.append(function(args, current_row, data_context, columns_context))
+            elif kind == 'sum' or kind == 'prod':
+                operands = stack[-value:]
+                del stack[-value:]
+                for operand in operands:
+                    if isinstance(operand, str):
+                        stack.append(operand)
+                        break
+                else:
+                    stack.append(sum(operands) if kind == 'sum' else math.prod(operands))
+            elif kind == 'neg':
+                operand = stack[-1]
+                if not isinstance(operand, str):
+                    stack[-1] = -operand
             else:
-                return '#ERROR!'
-        except Exception as e:
-            logger.error(f"Error in arithmetic operation: {str(e)}")
-            return '#ERROR!'
+                right = stack.pop()
+                left = stack[-1]
+                if isinstance(left, str):
+                    continue
+                if isinstance(right, str):
+                    stack[-1] = right
+                else:
+                    stack[-1] = _OPS[value](left, right)
+        return stack[0]
     
     def _find_column_by_title(self, title: str, columns_context: List[Dict]) -> Dict:
         """Find column definition by title"""
-        for column in columns_context:
-            if column.get('title') == title:
-                return column
-        return None
+        return self._col_by_title.get(title)
     
     def _get_numeric_value(self, value: Any) -> float:
         """Convert value to numeric, return 0 if not possible"""
-        try:
-            if isinstance(value, (int, float)):
-                return float(value)
-            elif isinstance(value, str):
-                # Remove any non-numeric characters except decimal point and minus
-                cleaned = re.sub(r'[^\d\.\-]', '', value)
+        if type(value) is float:
+            return value
+        if isinstance(value, (int, float)):
+            return float(value)
+        elif isinstance(value, str):
+            # Clean numeric text parses directly, float() also reads exponents,
+            # inf and nan, which the cleaning below would strip instead
+            try:
+                number = float(value)
+                if number - number == 0.0 and 'e' not in value and 'E' not in value:
+                    return number
+            except ValueError:
+                pass
+            # Remove any non-numeric characters except decimal point and minus
+            cleaned = _NUM_CLEAN_RE.sub('', value)
+            try:
                 return float(cleaned) if cleaned else 0
-            else:
+            except ValueError:
                 return 0
-        except (ValueError, TypeError):
+        else:
             return 0
@@ -4,22 +4,45 @@ Enhanced formula parser that extracts cell dependencies for the dependency graph
 
 import re
 import logging
-from typing import Set, List, Optional
+from functools import lru_cache
+from itertools import product
+from typing import FrozenSet, Optional
 from dependency_graph import CellRef
 
 logger = logging.getLogger(__name__)
 
+# Everything except parentheses, dropped before the balance check walks the formula
+_NON_PAREN_RE = re.compile(r'[^()]+')
+
+# A range or a single cell, ranges first so their endpoints are not also read as cells.
+# Case is ignored here and only the captured column letters are upper-cased.
+_REFERENCE_RE = re.compile(r'\b([A-Z]+)(\d+):([A-Z]+)(\d+)\b|\b([A-Z]+)(\d+)\b', re.IGNORECASE)
+
+
+@lru_cache(maxsize=4096)
+def _col_to_num_cached(col: str) -> int:
+    """Convert column letter(s) to number (A=1, B=2, ..., Z=26, AA=27, etc.)"""
+    result = 0
+    for char in col.upper():
+        result = result * 26 + (ord(char) - ord('A') + 1)
+    return result
+
+
+@lru_cache(maxsize=4096)
+def _num_to_col_cached(num: int) -> str:
+    """Convert number to column letter(s) (1=A, 2=B, ..., 26=Z, 27=AA, etc.)"""
+    result = ""
+    while num > 0:
+        num -= 1  # Adjust for 0-based indexing
+        result = chr(ord('A') + (num % 26)) + result
+        num //= 26
+    return result
+
 
 class FormulaParser:
     """Parse formulas and extract cell dependencies for the dependency graph."""
     
-    def __init__(self):
-        # Regex patterns for different types of references
-        self.cell_pattern = re.compile(r'\b([A-Z]+)(\d+)\b')
-        self.range_pattern = re.compile(r'\b([A-Z]+)(\d+):([A-Z]+)(\d+)\b')
-        self.function_pattern = re.compile(r'\b([A-Z]+)\s*\([^)]*\)')
-    
-    def extract_dependencies(self, formula: str) -> Set[CellRef]:
+    def extract_dependencies(self, formula: str) -> FrozenSet[CellRef]:
         """Extract all cell dependencies from a formula."""
         try:
             # Remove leading = if present
@@ -28,69 +51,45 @@ class FormulaParser:
             
             dependencies = set()
             
-            # Extract range references (A1:A5)
-            range_matches = self.range_pattern.findall(formula.upper())
-            for start_col, start_row, end_col, end_row in range_matches:
-                range_refs = self._expand_range(start_col, int(start_row), end_col, int(end_row))
-                dependencies.update(range_refs)
-            
-            # Remove range references from formula to avoid double-counting
-            formula_without_ranges = self.range_pattern.sub('', formula.upper())
+            # Range references (A1:A5) and individual cells (A1, B2, etc.) in one scan
+            for start_col, start_row, end_col, end_row, col, row in _REFERENCE_RE.findall(formula):
+                if start_col:
+                    dependencies.update(self._expand_range(start_col, int(start_row), end_col, int(end_row)))
+                else:
+                    dependencies.add(CellRef.make(col.upper(), int(row)))
             
-            # Extract individual cell references (A1, B2, etc.)
-            cell_matches = self.cell_pattern.findall(formula_without_ranges)
-            for col, row in cell_matches:
-                dependencies.add(CellRef(col, int(row)))
-            
-            logger.debug(f"Extracted {len(dependencies)} dependencies from formula: {formula}")
-            return dependencies
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Extracted {len(dependencies)} dependencies from formula: {formula}")
+            return frozenset(dependencies)
             
         except Exception as e:
             logger.error(f"Error extracting dependencies from formula '{formula}': {str(e)}")
-            return set()
+            return frozenset()
     
-    def _expand_range(self, start_col: str, start_row: int, end_col: str, end_row: int) -> Set[CellRef]:
+    def _expand_range(self, start_col: str, start_row: int, end_col: str, end_row: int) -> FrozenSet[CellRef]:
         """Expand a range reference (like A1:C3) into individual cell references."""
-        try:
-            cells = set()
-            
-            # Convert column letters to numbers for iteration
-            start_col_num = self._column_to_number(start_col)
-            end_col_num = self._column_to_number(end_col)
-            
-            # Ensure proper order
-            if start_col_num > end_col_num:
-                start_col_num, end_col_num = end_col_num, start_col_num
-            if start_row > end_row:
-                start_row, end_row = end_row, start_row
-            
-            # Generate all cells in the range
-            for col_num in range(start_col_num, end_col_num + 1):
-                col = self._number_to_column(col_num)
-                for row in range(start_row, end_row + 1):
-                    cells.add(CellRef(col, row))
-            
-            return cells
-            
-        except Exception as e:
-            logger.error(f"Error expanding range {start_col}{start_row}:{end_col}{end_row}: {str(e)}")
-            return set()
+        # Convert column letters to numbers for iteration
+        start_col_num = self._column_to_number(start_col)
+        end_col_num = self._column_to_number(end_col)
+        
+        # Ensure proper order
+        if start_col_num > end_col_num:
+            start_col_num, end_col_num = end_col_num, start_col_num
+        if start_row > end_row:
+            start_row, end_row = end_row, start_row
+        
+        # Generate all cells in the range, column letters are resolved once per column
+        cols = [self._number_to_column(col_num) for col_num in range(start_col_num, end_col_num + 1)]
+        make_cell_ref = CellRef.make
+        return frozenset(make_cell_ref(col, row) for col, row in product(cols, range(start_row, end_row + 1)))
     
     def _column_to_number(self, col: str) -> int:
         """Convert column letter(s) to number (A=1, B=2, ..., Z=26, AA=27, etc.)"""
-        result = 0
-        for char in col.upper():
-            result = result * 26 + (ord(char) - ord('A') + 1)
-        return result
+        return _col_to_num_cached(col)
     
     def _number_to_column(self, num: int) -> str:
         """Convert number to column letter(s) (1=A, 2=B, ..., 26=Z, 27=AA, etc.)"""
-        result = ""
-        while num > 0:
-            num -= 1  # Adjust for 0-based indexing
-            result = chr(ord('A') + (num % 26)) + result
-            num //= 26
-        return result
+        return _num_to_col_cached(num)
     
     def validate_formula_syntax(self, formula: str) -> tuple[bool, Optional[str]]:
         """Validate basic formula syntax."""
@@ -102,9 +101,9 @@ class FormulaParser:
             if not formula.strip():
                 return False, "Empty formula"
             
-            # Check for balanced parentheses
+            # Check for balanced parentheses, only the parentheses themselves are walked
             paren_count = 0
-            for char in formula:
+            for char in _NON_PAREN_RE.sub('', formula):
                 if char == '(':
                     paren_count += 1
                 elif char == ')':
@@ -0,0 +1,18 @@
+"""
+Gunicorn settings for the Formula Engine API.
+"""
+
+import multiprocessing
+import os
+
+bind = "0.0.0.0:8000"
+
+# Formula evaluation is CPU-bound, so run one worker process per core unless overridden.
+# Each worker imports app.py on its own and therefore has its own formula engine.
+# sched_getaffinity honours the container's CPU set, cpu_count would report the whole host.
+if hasattr(os, "sched_getaffinity"):
+    _cpus = len(os.sched_getaffinity(0))
+else:
+    _cpus = multiprocessing.cpu_count()
+workers = int(os.environ.get("WEB_CONCURRENCY", _cpus))
+timeout = 120